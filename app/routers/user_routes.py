@@ -19,6 +19,7 @@ Key Highlights:
 """
 
 from builtins import dict, int, len, str
+import os
 from datetime import timedelta
 from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, Response, status, Request,  UploadFile, File
@@ -275,17 +276,17 @@ async def upload_profile_picture(
     
     Returns the updated user information.
     """
-    # Check file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
+    # Check file size without reading the upload into memory
+    size = file.size
+    if size is None:
+        size = file.file.seek(0, os.SEEK_END)
+        file.file.seek(0)
+    if size > MAX_FILE_SIZE:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
             detail=f"File too large. Maximum size allowed is {MAX_FILE_SIZE / (1024 * 1024)}MB"
         )
     
-    # Reset file pointer after reading
-    await file.seek(0)
-    
     # Check if file type is allowed
     if not allowed_file(file):
         raise HTTPException(
@@ -5,15 +5,18 @@ Overview:
 This Python test file utilizes pytest to manage database states and HTTP clients for testing a web application built with FastAPI and SQLAlchemy. It includes detailed fixtures to mock the testing environment, ensuring each test is run in isolation with a consistent setup.
 
 Fixtures:
-- `async_client`: Manages an asynchronous HTTP client for testing interactions with the FastAPI application.
-- `db_session`: Handles database transactions to ensure a clean database state for each test.
+- `async_client`: Hands tests the session-wide asynchronous HTTP client, bound to the test's `db_session`.
+- `db_session`: Runs each test inside a transaction that is rolled back, ensuring a clean database state for each test.
 - User fixtures (`user`, `locked_user`, `verified_user`, etc.): Set up various user states to test different behaviors under diverse conditions.
 - `token`: Generates an authentication token for testing secured endpoints.
 - `initialize_database`: Prepares the database at the session start.
-- `setup_database`: Sets up and tears down the database before and after each test.
+- `setup_database`: Creates the tables once, the first time a test needs `db_session`, and drops them at the end of the session.
 """
 
 # Standard library imports
+import asyncio
+import os
+import sys
 from builtins import Exception, range, str
 from datetime import datetime, timedelta
 from unittest.mock import AsyncMock, patch
@@ -23,8 +26,9 @@ from uuid import uuid4
 import pytest
 from fastapi.testclient import TestClient
 from httpx import AsyncClient
+from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import sessionmaker
 from faker import Faker
 
 # Application-specific imports
@@ -40,12 +44,30 @@ from app.services.jwt_service import create_access_token
 from minio import Minio
 
 fake = Faker()
+# seeded so fixture data is reproducible from run to run
+Faker.seed(12345)
+
+# bcrypt is deliberately slow, so hash the shared fixture password once per session
+_DEFAULT_HASH = hash_password("MySuperPassword$1234")
 
 settings = get_settings()
 TEST_DATABASE_URL = settings.database_url.replace("postgresql://", "postgresql+asyncpg://")
 engine = create_async_engine(TEST_DATABASE_URL, echo=settings.debug)
 AsyncTestingSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
-AsyncSessionScoped = scoped_session(AsyncTestingSessionLocal)
+
+# Keep tmp_path directories in RAM. pytest reads this root lazily when it first
+# creates one, and an explicit --basetemp still takes precedence.
+def pytest_configure(config):
+    if sys.platform == "linux" and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        os.environ.setdefault("PYTEST_DEBUG_TEMPROOT", "/dev/shm")
+
+# One event loop for the whole session, so the session-scoped schema setup and
+# the engine's pooled connections can be shared by every test
+@pytest.fixture(scope="session")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
 
 # Configure MinIO client
 @pytest.fixture
@@ -64,15 +86,23 @@ def email_service():
     return email_service
 
 
+# one http client for the whole session, opened and closed on the shared event_loop
+@pytest.fixture(scope="session")
+def _client(event_loop):
+    client = AsyncClient(app=app, base_url="http://testserver")
+    event_loop.run_until_complete(client.__aenter__())
+    yield client
+    event_loop.run_until_complete(client.__aexit__(None, None, None))
+
 # this is what creates the http client for your api tests
+# it points the shared client at this test's db_session
 @pytest.fixture(scope="function")
-async def async_client(db_session):
-    async with AsyncClient(app=app, base_url="http://testserver") as client:
-        app.dependency_overrides[get_db] = lambda: db_session
-        try:
-            yield client
-        finally:
-            app.dependency_overrides.clear()
+def async_client(db_session, _client):
+    app.dependency_overrides[get_db] = lambda: db_session
+    try:
+        yield _client
+    finally:
+        app.dependency_overrides.clear()
 
 @pytest.fixture(scope="session", autouse=True)
 def initialize_database():
@@ -81,24 +111,37 @@ def initialize_database():
     except Exception as e:
         pytest.fail(f"Failed to initialize the database: {str(e)}")
 
-# this function setup and tears down (drops tales) for each test function, so you have a clean database for each test.
-@pytest.fixture(scope="function", autouse=True)
-async def setup_database():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+# this function creates the tables once for the test session and drops them at the end
+# it drives the shared event_loop directly, since pytest-asyncio runs async session fixtures in a separate loop
+# it is pulled in through db_session rather than autouse, so tests that never touch the database don't create tables
+@pytest.fixture(scope="session")
+def setup_database(event_loop):
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def drop_tables():
+        async with engine.begin() as conn:
+            # you can comment out this line during development if you are debugging a single test
+            await conn.run_sync(Base.metadata.drop_all)
+        await engine.dispose()
+
+    event_loop.run_until_complete(create_tables())
     yield
-    async with engine.begin() as conn:
-        # you can comment out this line during development if you are debugging a single test
-         await conn.run_sync(Base.metadata.drop_all)
-    await engine.dispose()
+    event_loop.run_until_complete(drop_tables())
 
+# each test runs inside a transaction that is rolled back afterwards, so you have a clean database for each test.
+# commits made by fixtures, tests or services only release a SAVEPOINT inside that transaction.
 @pytest.fixture(scope="function")
 async def db_session(setup_database):
-    async with AsyncSessionScoped() as session:
+    async with engine.connect() as connection:
+        transaction = await connection.begin()
+        session = AsyncTestingSessionLocal(bind=connection, join_transaction_mode="create_savepoint")
         try:
             yield session
         finally:
             await session.close()
+            await transaction.rollback()
 
 @pytest.fixture(scope="function")
 async def locked_user(db_session):
@@ -108,7 +151,7 @@ async def locked_user(db_session):
         "first_name": fake.first_name(),
         "last_name": fake.last_name(),
         "email": unique_email,
-        "hashed_password": hash_password("MySuperPassword$1234"),
+        "hashed_password": _DEFAULT_HASH,
         "role": UserRole.AUTHENTICATED,
         "email_verified": False,
         "is_locked": True,
@@ -116,7 +159,7 @@ async def locked_user(db_session):
     }
     user = User(**user_data)
     db_session.add(user)
-    await db_session.commit()
+    await db_session.flush()
     return user
 
 @pytest.fixture(scope="function")
@@ -126,14 +169,14 @@ async def user(db_session):
         "first_name": fake.first_name(),
         "last_name": fake.last_name(),
         "email": fake.email(),
-        "hashed_password": hash_password("MySuperPassword$1234"),
+        "hashed_password": _DEFAULT_HASH,
         "role": UserRole.AUTHENTICATED,
         "email_verified": False,
         "is_locked": False,
     }
     user = User(**user_data)
     db_session.add(user)
-    await db_session.commit()
+    await db_session.flush()
     return user
 
 @pytest.fixture(scope="function")
@@ -143,14 +186,14 @@ async def verified_user(db_session):
         "first_name": fake.first_name(),
         "last_name": fake.last_name(),
         "email": fake.email(),
-        "hashed_password": hash_password("MySuperPassword$1234"),
+        "hashed_password": _DEFAULT_HASH,
         "role": UserRole.AUTHENTICATED,
         "email_verified": True,
         "is_locked": False,
     }
     user = User(**user_data)
     db_session.add(user)
-    await db_session.commit()
+    await db_session.flush()
     return user
 
 @pytest.fixture(scope="function")
@@ -160,22 +203,21 @@ async def unverified_user(db_session):
         "first_name": fake.first_name(),
         "last_name": fake.last_name(),
         "email": fake.email(),
-        "hashed_password": hash_password("MySuperPassword$1234"),
+        "hashed_password": _DEFAULT_HASH,
         "role": UserRole.AUTHENTICATED,
         "email_verified": False,
         "is_locked": False,
     }
     user = User(**user_data)
     db_session.add(user)
-    await db_session.commit()
+    await db_session.flush()
     return user
 
 @pytest.fixture(scope="function")
 async def users_with_same_role_50_users(db_session):
     fake.unique.clear()
-    users = []
-    for _ in range(50):
-        user_data = {
+    rows = [
+        {
             "nickname": fake.unique.user_name(),
             "first_name": fake.first_name(),
             "last_name": fake.last_name(),
@@ -185,11 +227,11 @@ async def users_with_same_role_50_users(db_session):
             "email_verified": False,
             "is_locked": False,
         }
-        user = User(**user_data)
-        db_session.add(user)
-        users.append(user)
-    await db_session.commit()
-    return users
+        for _ in range(50)
+    ]
+    # a single bulk INSERT ... RETURNING instead of 50 unit-of-work inserts
+    result = await db_session.scalars(insert(User).returning(User), rows)
+    return result.all()
 
 @pytest.fixture
 async def admin_user(db_session: AsyncSession):
@@ -203,7 +245,7 @@ async def admin_user(db_session: AsyncSession):
         is_locked=False,
     )
     db_session.add(user)
-    await db_session.commit()
+    await db_session.flush()
     return user
 
 @pytest.fixture
@@ -218,7 +260,7 @@ async def manager_user(db_session: AsyncSession):
         is_locked=False,
     )
     db_session.add(user)
-    await db_session.commit()
+    await db_session.flush()
     return user
 
 # Configure a fixture for each type of user role you want to test
@@ -253,8 +295,8 @@ def email_service():
 @pytest.fixture
 def unique_user_data():
     return {
-        "nickname": f"user_{uuid.uuid4().hex[:8]}",
-        "email": f"user_{uuid.uuid4().hex[:8]}@example.com",
+        "nickname": fake.unique.user_name(),
+        "email": fake.unique.email(),
         "first_name": "Test",
         "last_name": "User",
         "role": "AUTHENTICATED"
@@ -263,7 +305,7 @@ def unique_user_data():
 @pytest.fixture
 async def test_user(db_session):
     user = User(
-        id=uuid.uuid4(),
+        id=uuid4(),
         nickname="test_user",
         email="testuser@example.com",
         role=UserRole.AUTHENTICATED,
@@ -273,6 +315,6 @@ async def test_user(db_session):
     hashed_password = hash_password("password123")
     user.hashed_password = hashed_password 
     db_session.add(user)
-    await db_session.commit()
+    await db_session.flush()
     await db_session.refresh(user)
     return user
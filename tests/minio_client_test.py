@@ -1,22 +1,39 @@
 import pytest
-import os
+import threading
+import time
 import uuid
+from types import SimpleNamespace
 from unittest import mock
 from fastapi import UploadFile
+from fastapi.datastructures import Headers
 from PIL import Image
 from io import BytesIO
 from minio.error import S3Error
 
 # Import the module to test
-from app.utils.minio_client import upload, allowed_file, resize_image
+from app.utils.minio_client import upload, allowed_file, _prepare_image, UPLOAD_PART_SIZE, MAX_FILE_SIZE, _ensure_bucket
+
+# Passes upload()'s magic-byte check, for tests where the content is never decoded
+_JPEG_HEADER = b"\xff\xd8\xff\xe0"
+
+# Raised by the mocked put_object in test_upload_s3_error
+_S3_ERROR = S3Error(
+    code="InternalError",
+    message="Internal server error",
+    resource="/bucket/object",
+    request_id="request123",
+    host_id="host123",
+    response="error"
+)
 
 # Fixtures
 
 @pytest.fixture
-def mock_minio_client():
+def mock_minio(monkeypatch):
     """Fixture to mock the Minio client."""
-    with patch("app.utils.minio_client.minio_client", autospec=True) as mock_client:
-        yield mock_client
+    mock_client = mock.MagicMock()
+    monkeypatch.setattr("app.utils.minio_client.minio_client", mock_client)
+    return mock_client
 
 
 @pytest.fixture
@@ -31,462 +48,446 @@ def mock_settings():
     }
     
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def test_user_id():
-    """Generate a test user ID"""
-    return uuid.uuid4()
+    """Fixed test user ID"""
+    return uuid.UUID("00000000-0000-0000-0000-000000000001")
+
+def _encode_image(mode, size, color, image_format):
+    """Encode a solid-color image to bytes"""
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+# The images are read-only, so each one is encoded once per session
+@pytest.fixture(scope="session")
+def _jpg_bytes():
+    return _encode_image("RGB", (400, 300), "red", "JPEG")
+
+@pytest.fixture(scope="session")
+def _large_jpg_bytes():
+    return _encode_image("RGB", (1200, 900), "purple", "JPEG")
+
+# For tests that never look at the image's dimensions
+@pytest.fixture(scope="session")
+def _small_jpg_bytes():
+    return _encode_image("RGB", (8, 8), "red", "JPEG")
+
+@pytest.fixture(scope="session")
+def _png_bytes():
+    return _encode_image("RGB", (400, 300), "green", "PNG")
+
+@pytest.fixture(scope="session")
+def _transparent_png_bytes():
+    return _encode_image("RGBA", (400, 300), (255, 255, 255, 0), "PNG")
 
 @pytest.fixture
-def test_jpg_image():
+def test_jpg_image(tmp_path, _jpg_bytes):
     """Create a test JPG image file"""
-    image_path = "/tmp/test_image.jpg"
-    img = Image.new("RGB", (400, 300), color="blue")
-    img.save(image_path)
-    yield image_path
-    # Cleanup
-    if os.path.exists(image_path):
-        os.remove(image_path)
+    image_path = tmp_path / "test_image.jpg"
+    image_path.write_bytes(_jpg_bytes)
+    return str(image_path)
 
 @pytest.fixture
-def test_png_image():
+def test_png_image(tmp_path, _png_bytes):
     """Create a test PNG image file"""
-    image_path = "/tmp/test_image.png"
-    img = Image.new("RGB", (400, 300), color="green")
-    img.save(image_path)
-    yield image_path
-    # Cleanup
-    if os.path.exists(image_path):
-        os.remove(image_path)
+    image_path = tmp_path / "test_image.png"
+    image_path.write_bytes(_png_bytes)
+    return str(image_path)
 
 @pytest.fixture
-def test_invalid_file():
+def test_invalid_file(tmp_path):
     """Create an invalid 'image' file (txt)"""
-    file_path = "/tmp/test_invalid.txt"
-    with open(file_path, "w") as f:
-        f.write("This is not an image")
-    yield file_path
-    # Cleanup
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    file_path = tmp_path / "test_invalid.txt"
+    file_path.write_text("This is not an image")
+    return str(file_path)
 
 @pytest.fixture
-def test_upload_file():
-    """Create a FastAPI UploadFile for testing"""
-    img = Image.new("RGB", (400, 300), color="red")
-    buffer = BytesIO()
-    img.save(buffer, format="JPEG")
-    buffer.seek(0)
-    return UploadFile(filename="test_upload.jpg", file=buffer)
+def test_upload_file(tmp_path, _jpg_bytes):
+    """Create a FastAPI UploadFile for testing, backed by a real file like Starlette's"""
+    image_path = tmp_path / "test_upload.jpg"
+    image_path.write_bytes(_jpg_bytes)
+    with open(image_path, "rb") as f:
+        yield UploadFile(filename="test_upload.jpg", file=f)
 
 @pytest.fixture
-def test_transparent_png():
-    """Create a transparent PNG image file"""
-    image_path = "/tmp/test_transparent.png"
-    img = Image.new("RGBA", (400, 300), (255, 255, 255, 0))
-    img.save(image_path)
-    yield image_path
-    # Cleanup
-    if os.path.exists(image_path):
-        os.remove(image_path)
-
+def test_large_upload_file(tmp_path, _large_jpg_bytes):
+    """Create a 1200x900 FastAPI UploadFile backed by a real file"""
+    image_path = tmp_path / "large_image.jpg"
+    image_path.write_bytes(_large_jpg_bytes)
+    with open(image_path, "rb") as f:
+        yield UploadFile(filename="large_image.jpg", file=f)
 
-# Tests for allowed_file function
-def test_allowed_file():
-    """Test allowed_file with various file types"""
-    file_data = BytesIO(b"dummy data")
-    
-    # Valid extensions
-    assert allowed_file(UploadFile(filename="image.jpg", file=file_data))
-    assert allowed_file(UploadFile(filename="image.jpeg", file=file_data))
-    assert allowed_file(UploadFile(filename="image.png", file=file_data))
-    
-    # Invalid extensions
-    assert not allowed_file(UploadFile(filename="image.gif", file=file_data))
-    assert not allowed_file(UploadFile(filename="image.txt", file=file_data))
-    assert not allowed_file(UploadFile(filename="image", file=file_data))  # No extension
-    assert not allowed_file(UploadFile(filename="", file=file_data))  # Empty filename
+@pytest.fixture
+def test_small_upload_file(_small_jpg_bytes):
+    """Create an 8x8 FastAPI UploadFile for tests that don't check dimensions"""
+    return UploadFile(filename="test_small.jpg", file=BytesIO(_small_jpg_bytes))
 
+@pytest.fixture
+def test_transparent_png(tmp_path, _transparent_png_bytes):
+    """Create a transparent PNG image file"""
+    image_path = tmp_path / "test_transparent.png"
+    image_path.write_bytes(_transparent_png_bytes)
+    return str(image_path)
 
-# Tests for resize_image function
-def test_resize_image(test_jpg_image, test_user_id):
+# Tests for allowed_file function
+# allowed_file only reads the filename, so a bare namespace stands in for UploadFile
+@pytest.mark.parametrize("filename, expected", [
+    ("image.jpg", True),
+    ("image.jpeg", True),
+    ("image.png", True),
+    ("image.JPG", True),  # Extensions are case-insensitive
+    ("image.PNG", True),
+    ("image.JPEG", True),
+    ("image.backup.jpg", True),  # Only the last extension counts
+    ("image.backup.gif", False),
+    ("image.gif", False),
+    ("image.txt", False),
+    ("image", False),  # No extension
+    ("", False),  # Empty filename
+])
+def test_allowed_file(filename, expected):
+    """Test allowed_file with various file names"""
+    assert allowed_file(SimpleNamespace(filename=filename)) == expected
+
+# Tests for _prepare_image function
+def test_prepare_image(test_jpg_image):
     """Test image resizing functionality"""
     size = (200, 200)
-    resized_path = resize_image(test_jpg_image, size, test_user_id)
-    
-    # Verify the resized image exists
-    assert os.path.exists(resized_path)
-    assert resized_path == f"/tmp/{str(test_user_id)}.jpg"
-    
-    # Verify the resized image has correct dimensions
-    with Image.open(resized_path) as img:
-        width, height = img.size
-        # The image should be at most 200x200, but might be smaller
-        # due to aspect ratio preservation
-        assert width <= size[0]
-        assert height <= size[1]
-        
-    # Clean up
-    os.remove(resized_path)
-
-def test_resize_image_png_with_transparency(test_transparent_png, test_user_id):
+    with Image.open(test_jpg_image) as img:
+        resized = _prepare_image(img, size)
+    
+    # The image should be at most 200x200, but might be smaller
+    # due to aspect ratio preservation
+    width, height = resized.size
+    assert width <= size[0]
+    assert height <= size[1]
+
+def test_prepare_image_png_with_transparency(test_transparent_png):
     """Test resizing a PNG image with transparency"""
     size = (200, 200)
-    resized_path = resize_image(test_transparent_png, size, test_user_id)
-    
-    # Verify the resized image exists
-    assert os.path.exists(resized_path)
-    assert resized_path == f"/tmp/{str(test_user_id)}.png"
+    with Image.open(test_transparent_png) as img:
+        resized = _prepare_image(img, size)
     
     # Verify the resized image has correct dimensions and mode
-    with Image.open(resized_path) as img:
-        width, height = img.size
-        assert width <= size[0]
-        assert height <= size[1]
-        assert img.mode in ("RGB", "L")  # Should have converted to non-transparent
-        
-    # Clean up
-    os.remove(resized_path)
-
-def test_resize_image_with_exif_rotation():
+    width, height = resized.size
+    assert width <= size[0]
+    assert height <= size[1]
+    assert resized.mode in ("RGB", "L")  # Should have converted to non-transparent
+
+def _save_with_orientation(image_path, orientation):
+    """Save a 400x300 image with a red top-left quadrant and the given EXIF orientation"""
+    img = Image.new("RGB", (400, 300), "blue")
+    img.paste("red", (0, 0, 200, 150))
+    exif = Image.Exif()
+    exif[274] = orientation  # EXIF orientation tag
+    img.save(image_path, exif=exif.tobytes())
+
+def _is_red(pixel):
+    red, green, blue = pixel
+    return red > 128 and blue < 128
+
+def test_prepare_image_with_exif_rotation(tmp_path):
     """Test resizing an image with EXIF rotation data"""
-    test_user_id = uuid.uuid4()
-    filename = f"test_exif.jpg"
-    img_path = f"/tmp/{filename}"
-    
-    # Create a basic image
-    img = Image.new("RGB", (400, 300), "red")
-    img.save(img_path)
-    
-    # Mock the Image.open to simulate EXIF data
-    with mock.patch("PIL.Image.open") as mock_open:
-        mock_img = mock.MagicMock()
-        mock_img.mode = "RGB"
-        mock_img.size = (400, 300)
-        mock_img._getexif.return_value = {274: 6}  # 6 means rotate 270 degrees
-        mock_open.return_value.__enter__.return_value = mock_img
-        
-        resize_image(img_path, (200, 200), test_user_id)
-        
-        # Verify that rotate was called
-        mock_img.rotate.assert_called_once_with(270, expand=True)
-    
-    # Clean up
-    if os.path.exists(img_path):
-        os.remove(img_path)
+    img_path = str(tmp_path / "test_exif.jpg")
+    _save_with_orientation(img_path, 6)  # 6 means rotate 90 degrees clockwise
+    
+    with Image.open(img_path) as img:
+        resized = _prepare_image(img, (200, 200))
+    
+    # The landscape image should have been turned into a portrait one
+    assert resized.size == (150, 200)
+    assert _is_red(resized.getpixel((resized.width - 10, 10)))
 
 
 # Tests for upload function
-@pytest.mark.asyncio
-async def test_upload_valid_image(test_upload_file, test_user_id):
+async def test_upload_valid_image(test_upload_file, test_user_id, mock_minio):
     """Test uploading a valid image"""
     # Reset the file pointer
     test_upload_file.file.seek(0)
     
-    # Mock the MinIO client and its methods
-    with mock.patch("app.utils.minio_client.minio_client") as mock_minio:
-        # Configure the mock
-        mock_minio.fput_object.return_value = None
-        
-        # Call the upload function
-        result = await upload(test_upload_file, test_user_id)
-        
-        # Check that MinIO client was called with correct parameters
-        mock_minio.fput_object.assert_called_once()
-        
-        # Verify result is a valid URL
-        assert result is not None
-        assert result.startswith("http://")
-        assert str(test_user_id) in result
-
-@pytest.mark.asyncio
-async def test_upload_invalid_filetype(test_user_id):
-    """Test uploading an invalid file type"""
-    # Create invalid file
-    invalid_file = UploadFile(filename="invalid.txt", file=BytesIO(b"not an image"))
+    # Configure the mock
+    mock_minio.put_object.return_value = None
+    
+    # Call the upload function
+    result = await upload(test_upload_file, test_user_id)
+    
+    # Check that MinIO client was called with correct parameters
+    mock_minio.put_object.assert_called_once()
+    args, kwargs = mock_minio.put_object.call_args
+    assert args[1] == f"{test_user_id}.jpg"
+    assert kwargs["length"] == len(args[2].getvalue())
+    assert kwargs["content_type"] == "image/jpeg"
+    assert kwargs["part_size"] == UPLOAD_PART_SIZE
+    with Image.open(args[2]) as img:
+        assert img.size[0] <= 200 and img.size[1] <= 200
     
-    # Mock the MinIO client
-    with mock.patch("app.utils.minio_client.minio_client") as mock_minio:
-        # Call the upload function
-        result = await upload(invalid_file, test_user_id)
-        
-        # Verify MinIO client was not called
-        mock_minio.fput_object.assert_not_called()
-        
-        # Verify result is None
-        assert result is None
+    # Verify result is a valid URL
+    assert result is not None
+    assert result.startswith("http://")
+    assert str(test_user_id) in result
 
+async def test_upload_strips_metadata_and_trailing_data(_small_jpg_bytes, test_user_id, mock_minio):
+    """Test that a small JPEG is re-encoded, dropping its EXIF and anything after the image"""
+    with Image.open(BytesIO(_small_jpg_bytes)) as img:
+        exif = Image.Exif()
+        exif[0x010F] = "TestCam"  # Make
+        exif.get_ifd(0x8825)[1] = "N"  # GPSLatitudeRef
+        buffer = BytesIO()
+        img.save(buffer, format="JPEG", exif=exif.tobytes())
+    original = buffer.getvalue() + b"<script>alert(1)</script>"
+    small_file = UploadFile(filename="small.jpg", file=BytesIO(original))
+    
+    result = await upload(small_file, test_user_id)
+    
+    assert result is not None
+    args, kwargs = mock_minio.put_object.call_args
+    stored = args[2].getvalue()
+    assert b"<script>" not in stored
+    with Image.open(BytesIO(stored)) as img:
+        assert len(img.getexif()) == 0
 
+async def test_upload_runs_off_event_loop(test_small_upload_file, test_user_id, mock_minio):
+    """Test that image processing and the MinIO call run in a worker thread"""
+    threads = []
+    
+    def record_thread(*args, **kwargs):
+        threads.append(threading.current_thread())
+    
+    mock_minio.put_object.side_effect = record_thread
+    
+    result = await upload(test_small_upload_file, test_user_id)
+    
+    assert result is not None
+    assert threads and threads[0] is not threading.main_thread()
 
-@pytest.mark.asyncio
-async def test_upload_no_minio_client(test_upload_file, test_user_id):
-    """Test upload when MinIO client is not initialized"""
-    # Reset the file pointer
-    test_upload_file.file.seek(0)
+async def test_upload_creates_missing_bucket(test_small_upload_file, test_user_id, mock_minio):
+    """Test that the bucket is checked and created lazily on first upload"""
+    _ensure_bucket.cache_clear()
     
-    # Mock minio_client to be None
-    with mock.patch("app.utils.minio_client.minio_client", None):
-        # Call the upload function
-        result = await upload(test_upload_file, test_user_id)
-        
-        # Verify result is None
-        assert result is None
-
-@pytest.mark.asyncio
-async def test_upload_large_image(test_user_id):
-    """Test uploading a large image that will be resized"""
-    # Create a large image
-    img = Image.new("RGB", (1200, 900), "purple")
-    buffer = BytesIO()
-    img.save(buffer, format="JPEG")
-    buffer.seek(0)
-    
-    large_file = UploadFile(filename="large_image.jpg", file=buffer)
-    
-    # Mock the MinIO client
-    with mock.patch("app.utils.minio_client.minio_client") as mock_minio:
-        # Call the upload function
-        result = await upload(large_file, test_user_id)
-        
-        # Verify MinIO client was called
-        mock_minio.fput_object.assert_called_once()
-        
-        # Verify result is a valid URL
-        assert result is not None
-        assert result.startswith("http://")
-
-def test_allowed_file_case_insensitive():
-    """Test allowed_file with uppercase extensions"""
-    file_data = BytesIO(b"dummy data")
-    
-    # Uppercase extensions should still be allowed
-    assert allowed_file(UploadFile(filename="image.JPG", file=file_data))
-    assert allowed_file(UploadFile(filename="image.PNG", file=file_data))
-    assert allowed_file(UploadFile(filename="image.JPEG", file=file_data))
-
-def test_allowed_file_with_dots():
-    """Test allowed_file with filenames containing multiple dots"""
-    file_data = BytesIO(b"dummy data")
-    
-    # Multiple dots in filename
-    assert allowed_file(UploadFile(filename="image.backup.jpg", file=file_data))
-    assert not allowed_file(UploadFile(filename="image.backup.gif", file=file_data))
-
-# Additional tests for resize_image function
-def test_resize_image_square(test_user_id):
-    """Test resizing a square image"""
-    image_path = "/tmp/test_square.jpg"
-    img = Image.new("RGB", (400, 400), color="yellow")
-    img.save(image_path)
+    mock_minio.bucket_exists.return_value = False
     
-    size = (200, 200)
-    resized_path = resize_image(image_path, size, test_user_id)
+    result = await upload(test_small_upload_file, test_user_id)
     
-    # Verify dimensions
-    with Image.open(resized_path) as img:
-        width, height = img.size
-        assert width == size[0]
-        assert height == size[0]  # Should be square
+    assert result is not None
+    mock_minio.make_bucket.assert_called_once()
     
-    # Clean up
-    os.remove(image_path)
-    os.remove(resized_path)
+    _ensure_bucket.cache_clear()
 
-def test_resize_image_wide(test_user_id):
-    """Test resizing a wide (landscape) image"""
-    image_path = "/tmp/test_wide.jpg"
-    img = Image.new("RGB", (600, 300), color="orange")
-    img.save(image_path)
+def test_ensure_bucket_concurrent_first_calls(mock_minio):
+    """Test that concurrent first calls create the bucket only once"""
+    _ensure_bucket.cache_clear()
+    created = threading.Event()
     
-    size = (200, 200)
-    resized_path = resize_image(image_path, size, test_user_id)
+    # bucket_exists only reports the bucket once make_bucket has run
+    mock_minio.bucket_exists.side_effect = lambda name: created.is_set()
     
-    # Verify dimensions - width should be maxed, height proportional
-    with Image.open(resized_path) as img:
-        width, height = img.size
-        assert width == size[0]
-        assert height < size[1]  # Height should be smaller due to aspect ratio
+    def make_bucket(name):
+        time.sleep(0.05)  # Give the other thread time to check the bucket
+        created.set()
+    mock_minio.make_bucket.side_effect = make_bucket
     
-    # Clean up
-    os.remove(image_path)
-    os.remove(resized_path)
+    threads = [threading.Thread(target=_ensure_bucket) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    mock_minio.make_bucket.assert_called_once()
+    _ensure_bucket.cache_clear()
 
-def test_resize_image_tall(test_user_id):
-    """Test resizing a tall (portrait) image"""
-    image_path = "/tmp/test_tall.jpg"
-    img = Image.new("RGB", (300, 600), color="purple")
-    img.save(image_path)
+async def test_upload_invalid_filetype(test_user_id, mock_minio):
+    """Test uploading an invalid file type"""
+    # Create invalid file
+    invalid_file = UploadFile(filename="invalid.txt", file=BytesIO(b"not an image"))
     
-    size = (200, 200)
-    resized_path = resize_image(image_path, size, test_user_id)
+    # Call the upload function
+    result = await upload(invalid_file, test_user_id)
     
-    # Verify dimensions - height should be maxed, width proportional
-    with Image.open(resized_path) as img:
-        width, height = img.size
-        assert width < size[0]  # Width should be smaller due to aspect ratio
-        assert height == size[1]
+    # Verify MinIO client was not called
+    mock_minio.put_object.assert_not_called()
     
-    # Clean up
-    os.remove(image_path)
-    os.remove(resized_path)
+    # Verify result is None
+    assert result is None
 
 
-def test_resize_image_with_other_exif_orientations():
-    """Test different EXIF orientation values"""
-    test_user_id = uuid.uuid4()
-    img_path = "/tmp/test_exif_multi.jpg"
+
+async def test_upload_no_minio_client(test_small_upload_file, test_user_id, monkeypatch):
+    """Test upload when MinIO client is not initialized"""
+    # Mock minio_client to be None
+    monkeypatch.setattr("app.utils.minio_client.minio_client", None)
+    # Call the upload function
+    result = await upload(test_small_upload_file, test_user_id)
     
-    # Create a basic image
-    img = Image.new("RGB", (400, 300), "blue")
-    img.save(img_path)
+    # Verify result is None
+    assert result is None
+
+async def test_upload_large_image(test_large_upload_file, test_user_id, mock_minio):
+    """Test uploading a large image that will be resized"""
+    # Call the upload function
+    result = await upload(test_large_upload_file, test_user_id)
     
-    orientations = {
-        1: 0,    # Normal orientation
-        3: 180,  # 180° rotation
-        6: 270,  # 270° rotation
-        8: 90,   # 90° rotation
-    }
+    # Verify MinIO client was called
+    mock_minio.put_object.assert_called_once()
     
-    for exif_value, expected_rotation in orientations.items():
-        with mock.patch("PIL.Image.open") as mock_open:
-            mock_img = mock.MagicMock()
-            mock_img.mode = "RGB"
-            mock_img.size = (400, 300)
-            mock_img._getexif.return_value = {274: exif_value}  # EXIF orientation tag
-            mock_open.return_value.__enter__.return_value = mock_img
-            
-            resize_image(img_path, (200, 200), test_user_id)
-            
-            # Verify rotation was called with correct angle if not normal orientation
-            if exif_value != 1:
-                mock_img.rotate.assert_called_once_with(expected_rotation, expand=True)
-            else:
-                mock_img.rotate.assert_not_called()
+    # Verify result is a valid URL
+    assert result is not None
+    assert result.startswith("http://")
+
+# Additional tests for _prepare_image function
+@pytest.mark.parametrize("source_size, expected_size", [
+    ((400, 400), (200, 200)),  # Square
+    ((600, 300), (200, 100)),  # Wide: width maxed, height proportional
+    ((300, 600), (100, 200)),  # Tall: height maxed, width proportional
+])
+def test_prepare_image_dimensions(source_size, expected_size):
+    """Test resizing square, wide and tall images"""
+    img = Image.new("RGB", source_size, color="yellow")
+    
+    resized = _prepare_image(img, (200, 200))
+    
+    # Verify dimensions
+    assert resized.size == expected_size
+
+
+# Expected size and position of the red quadrant for each orientation
+@pytest.mark.parametrize("exif_value, expected_size, red_pixel", [
+    (1, (200, 150), (10, 10)),     # Normal orientation
+    (3, (200, 150), (190, 140)),   # 180° rotation
+    (6, (150, 200), (140, 10)),    # 90° clockwise rotation
+    (8, (150, 200), (10, 190)),    # 90° counter-clockwise rotation
+])
+def test_prepare_image_with_other_exif_orientations(exif_value, expected_size, red_pixel, tmp_path):
+    """Test different EXIF orientation values"""
+    img_path = str(tmp_path / "test_exif_multi.jpg")
+    _save_with_orientation(img_path, exif_value)
     
-    # Clean up
-    if os.path.exists(img_path):
-        os.remove(img_path)
+    with Image.open(img_path) as img:
+        resized = _prepare_image(img, (200, 200))
+    
+    assert resized.size == expected_size
+    assert _is_red(resized.getpixel(red_pixel))
 
 # Additional tests for upload function
-@pytest.mark.asyncio
-async def test_upload_file_size_limit():
+async def test_upload_file_size_limit(test_user_id, mock_minio):
     """Test uploading a file exceeding size limit"""
-    test_user_id = uuid.uuid4()
-    
-    # Create a file that would exceed size limit
-    # but mock the file size check
-    buffer = BytesIO(b"small content")
+    # JPEG header followed by more data than the size limit allows
+    buffer = BytesIO(b"\xff\xd8\xff" + b"x" * MAX_FILE_SIZE)
     large_file = UploadFile(filename="test.jpg", file=buffer)
     
-    # Mock file read to return something that would exceed size limit
-    original_read = large_file.read
-    large_file.read = mock.AsyncMock(return_value=b"x" * (11 * 1024 * 1024))  # 11MB
-    
-    # Mock MinIO client
-    with mock.patch("app.utils.minio_client.minio_client"):
-        result = await upload(large_file, test_user_id)
-        
-        # Since we're not actually checking file size in the code,
-        # this test is more for future implementation
-        # Restore original method to avoid issues
-        large_file.read = original_read
-
-@pytest.mark.asyncio
-async def test_upload_s3_error():
-    """Test handling of S3Error during upload"""
-    test_user_id = uuid.uuid4()
+    result = await upload(large_file, test_user_id)
     
-    # Create valid file
-    buffer = BytesIO()
-    img = Image.new("RGB", (100, 100), "red")
-    img.save(buffer, format="JPEG")
-    buffer.seek(0)
+    # Should be rejected without uploading anything
+    assert result is None
+    mock_minio.put_object.assert_not_called()
+
+async def test_upload_non_image_content(test_user_id, monkeypatch, mock_minio):
+    """Test uploading a file with an image extension but non-image content"""
+    fake_image = UploadFile(filename="fake.jpg", file=BytesIO(b"not an image"))
+    
+    mock_img_open = mock.MagicMock()
+    monkeypatch.setattr("PIL.Image.open", mock_img_open)
+    result = await upload(fake_image, test_user_id)
+    
+    # Should be rejected before decoding or uploading
+    assert result is None
+    mock_img_open.assert_not_called()
+    mock_minio.put_object.assert_not_called()
+
+async def test_upload_rejects_declared_size_without_reading(test_user_id, monkeypatch, mock_minio):
+    """Test that a file whose declared size exceeds the limit is rejected before it is read"""
+    large_file = UploadFile(filename="test.jpg", file=BytesIO(_JPEG_HEADER), size=MAX_FILE_SIZE + 1)
+    mock_read = mock.AsyncMock()
+    monkeypatch.setattr(large_file, "read", mock_read)
+    
+    result = await upload(large_file, test_user_id)
     
-    valid_file = UploadFile(filename="test.jpg", file=buffer)
+    assert result is None
+    mock_read.assert_not_called()
+    assert large_file.file.tell() == 0
+    mock_minio.put_object.assert_not_called()
+
+async def test_upload_rejects_non_image_content_type(test_user_id, monkeypatch, mock_minio):
+    """Test that a file with a non-image Content-Type is rejected before it is read"""
+    text_file = UploadFile(
+        filename="test.jpg",
+        file=BytesIO(_JPEG_HEADER),
+        headers=Headers({"content-type": "text/plain"}),
+    )
+    mock_read = mock.AsyncMock()
+    monkeypatch.setattr(text_file, "read", mock_read)
+    
+    result = await upload(text_file, test_user_id)
+    
+    assert result is None
+    mock_read.assert_not_called()
+    assert text_file.file.tell() == 0
+    mock_minio.put_object.assert_not_called()
+
+async def test_upload_s3_error(test_user_id, monkeypatch, mock_minio):
+    """Test handling of S3Error during upload"""
+    # Image.open is mocked below, so only the JPEG header is needed
+    valid_file = UploadFile(filename="test.jpg", file=BytesIO(_JPEG_HEADER))
     
     # Mock MinIO client to raise S3Error
-    with mock.patch("app.utils.minio_client.minio_client") as mock_minio:
-        mock_minio.fput_object.side_effect = S3Error(
-            code="InternalError",
-            message="Internal server error",
-            resource="/bucket/object",
-            request_id="request123",
-            host_id="host123",
-            response="error"
-        )
-        
-        # Mock open and Image.open to avoid actual file operations
-        with mock.patch("builtins.open", mock.mock_open()), \
-             mock.patch("PIL.Image.open") as mock_img_open:
-            mock_img = mock.MagicMock()
-            mock_img.mode = "RGB"
-            mock_img.size = (100, 100)
-            mock_img_open.return_value.__enter__.return_value = mock_img
-            
-            result = await upload(valid_file, test_user_id)
-            
-            # Should handle the error and return None
-            assert result is None
+    mock_minio.put_object.side_effect = _S3_ERROR
+    
+    # Hand back a real tiny image instead of decoding the upload
+    monkeypatch.setattr("PIL.Image.open", lambda fp: Image.new("RGB", (4, 4)))
+    
+    result = await upload(valid_file, test_user_id)
+    
+    # Should reach MinIO, handle the error and return None
+    mock_minio.put_object.assert_called_once()
+    assert result is None
 
-@pytest.mark.asyncio
-async def test_upload_file_without_extension():
+async def test_upload_file_without_extension(test_user_id, mock_minio):
     """Test uploading a file without an extension"""
-    test_user_id = uuid.uuid4()
-    
     # Create file without extension
     no_ext_file = UploadFile(filename="testimage", file=BytesIO(b"content"))
     
-    # Mock MinIO client
-    with mock.patch("app.utils.minio_client.minio_client") as mock_minio:
-        result = await upload(no_ext_file, test_user_id)
-        
-        # Should return None as file isn't allowed
-        assert result is None
-        # Verify MinIO client was not called
-        mock_minio.fput_object.assert_not_called()
+    result = await upload(no_ext_file, test_user_id)
+    
+    # Should return None as file isn't allowed
+    assert result is None
+    # Verify MinIO client was not called
+    mock_minio.put_object.assert_not_called()
 
 
 
-@pytest.mark.asyncio
-async def test_upload_handles_file_open_errors():
+async def test_upload_handles_file_open_errors(test_user_id, monkeypatch, mock_minio):
     """Test handling errors when opening files"""
-    test_user_id = uuid.uuid4()
+    # Create file with a valid JPEG header
+    valid_file = UploadFile(filename="test.jpg", file=BytesIO(_JPEG_HEADER))
     
-    # Create valid file
-    valid_file = UploadFile(filename="test.jpg", file=BytesIO(b"content"))
+    # Make opening the uploaded image fail
+    mock_img_open = mock.MagicMock(side_effect=OSError("Cannot open file"))
+    monkeypatch.setattr("PIL.Image.open", mock_img_open)
     
-    # Mock MinIO client
-    with mock.patch("app.utils.minio_client.minio_client") as mock_minio:
-        # Mock open to raise an exception
-        with mock.patch("builtins.open") as mock_open:
-            mock_open.side_effect = IOError("Cannot open file")
-            
-            result = await upload(valid_file, test_user_id)
-            
-            # Should handle the error and return None
-            assert result is None
-            # Verify MinIO client was not called
-            mock_minio.fput_object.assert_not_called()
+    result = await upload(valid_file, test_user_id)
+    
+    # Should handle the error and return None
+    assert result is None
+    mock_img_open.assert_called_once()
+    # Verify MinIO client was not called
+    mock_minio.put_object.assert_not_called()
 
-@pytest.mark.asyncio
-async def test_upload_handles_resize_errors():
+async def test_upload_handles_resize_errors(test_user_id, monkeypatch, mock_minio):
     """Test handling errors during image resizing"""
-    test_user_id = uuid.uuid4()
+    # Create file with a valid JPEG header
+    valid_file = UploadFile(filename="test.jpg", file=BytesIO(_JPEG_HEADER))
     
-    # Create valid file
-    valid_file = UploadFile(filename="test.jpg", file=BytesIO(b"content"))
+    # Mock image processing to fail
+    monkeypatch.setattr("PIL.Image.open", mock.MagicMock())
+    mock_resize = mock.MagicMock(side_effect=Exception("Failed to resize"))
+    monkeypatch.setattr("app.utils.minio_client._prepare_image", mock_resize)
     
-    # Mock MinIO client
-    with mock.patch("app.utils.minio_client.minio_client") as mock_minio:
-        # Mock open to work but resize_image to fail
-        with mock.patch("builtins.open", mock.mock_open()), \
-             mock.patch("app.utils.minio_client.resize_image") as mock_resize:
-            mock_resize.side_effect = Exception("Failed to resize")
-            
-            result = await upload(valid_file, test_user_id)
-            
-            # Should handle the error and return None
-            assert result is None
-            # Verify MinIO client was not called
-            mock_minio.fput_object.assert_not_called()
+    result = await upload(valid_file, test_user_id)
+    
+    # Should handle the error and return None
+    assert result is None
+    mock_resize.assert_called_once()
+    # Verify MinIO client was not called
+    mock_minio.put_object.assert_not_called()
             
 
@@ -45,12 +45,13 @@ async def test_user_role(db_session, admin_user):
 async def test_bulk_user_creation_performance(
     db_session, users_with_same_role_50_users
 ):
-    async with db_session.begin():
+    # the fixture leaves its transaction open, so use SAVEPOINTs here
+    async with db_session.begin_nested():
         for user in users_with_same_role_50_users:
             db_session.add(user)
         await db_session.flush()
 
-    async with db_session.begin():
+    async with db_session.begin_nested():
         result = await db_session.execute(
             select(User).filter_by(role=UserRole.AUTHENTICATED)
         )